@@ -1,21 +1,176 @@
 import os
-import cv2
+import atexit
+import bisect
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
 import numpy as np
 from PIL import Image
 from PIL.PngImagePlugin import PngInfo
-import hashlib
 import base64
 from tkinter import Tk, filedialog
-import json
+import orjson
 from datetime import datetime
 import imagehash
+import xxhash
+
+# 每个字节值(0-255)中置位的数量, 用于批量统计汉明距离
+_POPCNT_LUT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+if hasattr(np, 'bitwise_count'):
+    def _popcount_rows(values):
+        """统计uint64数组每一行(一维数组则为每个元素)中置位的总数"""
+        # NumPy >= 2.0 提供逐元素popcount, 可编译为硬件POPCNT指令
+        counts = np.bitwise_count(values)
+        return counts.sum(axis=tuple(range(1, counts.ndim)), dtype=np.int32)
+else:
+    def _popcount_rows(values):
+        """统计uint64数组每一行(一维数组则为每个元素)中置位的总数"""
+        counts = _POPCNT_LUT[values[..., None].view(np.uint8)]
+        return counts.sum(axis=tuple(range(1, counts.ndim)), dtype=np.int32)
+
+def _to_pil_image(image):
+    """将numpy图像数组转换为PIL图像(兼容旧版接口), PIL图像原样返回"""
+    if isinstance(image, np.ndarray):
+        if image.dtype != np.uint8:
+            image = (image * 255).astype(np.uint8)
+        return Image.fromarray(image)
+    return image
+
+def _bits_to_int(bits):
+    """将布尔位数组(按行展开, 高位在前)打包为整数, 与imagehash的十六进制表示一致"""
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+# 数据库条目数达到该值时才使用numba内核(小数据库上JIT调度开销不划算)
+_NUMBA_MIN_ROWS = 100_000
+
+# numba内核在首次扫描大数据库时才导入和定义(导入numba本身约需数百毫秒)
+_numba_scanner = None
+_numba_checked = False
+
+def _get_numba_scanner():
+    """返回numba并行扫描内核, numba未安装时返回None"""
+    global _numba_scanner, _numba_checked
+    if _numba_checked:
+        return _numba_scanner
+    try:
+        from numba import njit, prange
+    except ImportError:  # numba为可选依赖, 未安装时使用NumPy实现
+        _numba_checked = True
+        return None
+    
+    @njit(cache=True)
+    def _popcount64(x):
+        """64位整数的置位数量(LLVM会将该模式识别为popcnt指令)"""
+        x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+        x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+        x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+        return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+    
+    @njit(parallel=True, cache=True)
+    def _scan_fingerprints(matrix, full, ahash, phash, dhash, max_distance, max_dhash_distance):
+        """单次并行扫描指纹矩阵, 返回每行的汉明距离及是否在距离上限内
+        
+        full[i] 为False的行只比较dHash(64位), 其余行比较全部192位
+        """
+        n = matrix.shape[0]
+        distances = np.empty(n, np.int32)
+        hits = np.empty(n, np.bool_)
+        for i in prange(n):
+            c = _popcount64(matrix[i, 2] ^ dhash)
+            if full[i]:
+                c += _popcount64(matrix[i, 0] ^ ahash) + _popcount64(matrix[i, 1] ^ phash)
+                hits[i] = c <= max_distance
+            else:
+                hits[i] = c <= max_dhash_distance
+            distances[i] = c
+        return distances, hits
+    
+    _numba_scanner = _scan_fingerprints
+    _numba_checked = True
+    return _numba_scanner
+
+# 有尚未写入文件的修改的处理器, 退出时写入
+# (只在有未保存修改期间保留强引用, 保存后即可被回收; 未保存的处理器不会因被回收而丢失修改)
+_dirty_processors = set()
+
+@atexit.register
+def _flush_dirty_processors():
+    for processor in list(_dirty_processors):
+        processor.flush_fingerprint_database()
+
+@dataclass(slots=True)
+class LoadedImage:
+    """已加载图像的信息 - 'array' 在首次访问时才由PIL图像转换为RGB数组
+    
+    支持 info['filename'] / info.get('fingerprint') / 'fingerprint' in info / dict(info) 形式的字典式访问
+    """
+    path: str
+    size: tuple
+    mode: str
+    format: str
+    filename: str = None
+    fingerprint: tuple = None
+    load_time: str = None
+    file_size: int = 0
+    _pil_image: object = field(default=None, repr=False)
+    # _pil_image 是缩小解码的(draft)时, 生成数组需要重新按全分辨率读取原文件
+    _reduced: bool = field(default=False, repr=False)
+    _array: object = field(default=None, repr=False)
+    
+    @property
+    def array(self):
+        if self._array is None:
+            pil_image = Image.open(self.path) if self._reduced else self._pil_image
+            
+            # 在PIL中转换为RGB格式（如果需要）, 避免先生成RGBA/灰度数组再转换
+            if pil_image.mode != 'RGB':
+                pil_image = pil_image.convert('RGB')
+            # 'array' 会交给调用方使用(可能原地修改), 因此使用可写的 np.array 而不是只读的 np.asarray
+            self._array = np.array(pil_image)
+            
+            # 数组生成后不再需要保留PIL图像
+            self._pil_image = None
+        return self._array
+    
+    def __getitem__(self, key):
+        if not isinstance(key, str) or key.startswith('_'):
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def keys(self):
+        """公开字段名, 与旧版字典的键一致"""
+        return [f.name for f in fields(self) if not f.name.startswith('_')] + ['array']
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __contains__(self, key):
+        return isinstance(key, str) and key in self.keys()
 
 class ImageImportProcessor:
     """图像导入处理器 - 支持数字指纹和持久化存储"""
     
-    def __init__(self, storage_file='image_fingerprints.json'):
+    def __init__(self, storage_file='image_fingerprints.json', exact_image_hash=False, write_interval=10, pretty_json=False):
         self.supported_formats = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp']
         self.loaded_images = {}
+        self._sorted_hashes = []  # 已排序的图像哈希, 用于按前缀查找
+        self._lock = threading.RLock()  # 保护数据库和已加载图像索引, 支持多线程批量加载 (可重入: 公开方法之间会互相调用)
+        self._fp_cache = {}  # 图像哈希 -> 数字指纹, 避免重复加载同一内容时重新计算
+        # 快速指纹(仅dHash)的粗筛阈值, 达到该相似度时才计算完整指纹进行确认
+        self.screen_threshold = 80
+        # 为True时对完整像素数据做哈希(逐像素精确), 否则对缩略图做哈希
+        self.exact_image_hash = exact_image_hash
         
         # 使用绝对路径存储数据库文件
         if not os.path.isabs(storage_file):
@@ -24,8 +179,19 @@ class ImageImportProcessor:
             self.storage_file = os.path.join(script_dir, storage_file)
         else:
             self.storage_file = storage_file
+        # 指纹矩阵以二进制格式单独保存, JSON文件只保存元数据(文件名、位置等)
+        self.matrix_file = os.path.splitext(self.storage_file)[0] + '.npz'
             
         self.fingerprint_database = {}  # 指纹数据库
+        # 与数据库平行的指纹矩阵, 每行为 (aHash, pHash, dHash), 用于向量化相似度计算
+        # (预分配容量, 有效行数为 len(self._fp_ids), 通过 _fp_matrix / _fp_full 访问)
+        self._set_fingerprint_index([], np.empty((0, 3), dtype=np.uint64), np.empty(0, dtype=bool))
+        
+        # 批量写入: 每累计 write_interval 次修改才写一次文件, 退出时写入剩余修改
+        self.write_interval = write_interval
+        self.pretty_json = pretty_json  # 为True时以缩进格式写入, 便于调试查看
+        self._dirty = False
+        self._writes_since_flush = 0
         
         # 启动时加载历史记录
         print(f"📂 数据库文件位置: {self.storage_file}")
@@ -36,8 +202,12 @@ class ImageImportProcessor:
         _, ext = os.path.splitext(file_path)
         return ext.lower() in self.supported_formats
     
-    def load_image_from_path(self, file_path):
-        """从文件路径导入图像 - 增强版带指纹识别"""
+    def load_image_from_path(self, file_path, fast_fingerprint=False):
+        """从文件路径导入图像 - 增强版带指纹识别
+        
+        fast_fingerprint为True时, JPEG在解码时直接缩小, 缩小的图像只用于快速指纹粗筛;
+        写入数据库的指纹总是按全分辨率计算, 加载结果中只保留缩小的图像, 首次访问 'array' 时才按全分辨率重新读取
+        """
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"文件不存在: {file_path}")
         
@@ -47,141 +217,284 @@ class ImageImportProcessor:
         try:
             # 使用PIL加载图像
             pil_image = Image.open(file_path)
-            image_array = np.array(pil_image)
+            size, mode = pil_image.size, pil_image.mode
             
-            # 转换为RGB格式（如果需要）
-            if len(image_array.shape) == 2:  # 灰度图
-                image_array = cv2.cvtColor(image_array, cv2.COLOR_GRAY2RGB)
-            elif image_array.shape[2] == 4:  # RGBA
-                image_array = cv2.cvtColor(image_array, cv2.COLOR_RGBA2RGB)
+            # 快速指纹只用到9x8灰度图, JPEG可由libjpeg在DCT域按1/2~1/8比例直接解码
+            # (精确图像哈希需要完整像素数据, 此时不缩小解码)
+            reduced = (fast_fingerprint and not self.exact_image_hash
+                       and pil_image.draft('L', (64, 64)) is not None)
             
-            # 生成数字指纹
-            fingerprint = self.generate_perceptual_hash(image_array)
+            # 生成图像哈希作为唯一标识
+            image_hash = self.generate_image_hash(pil_image)
             
-            # 检查是否是已知图片
-            similar_images = self.find_similar_images(fingerprint, threshold=90)
+            # 优先使用 save_image 嵌入的指纹, 其次是本次会话中相同内容已计算过的指纹,
+            # 都没有时只计算快速指纹(仅dHash) (直接在PIL图像上计算, 不转换为numpy数组)
+            fingerprint = self.read_embedded_fingerprint(pil_image)
+            if fingerprint is None:
+                fingerprint = self._fp_cache.get(image_hash)
+            if fingerprint is None:
+                fingerprint = self._fast_fingerprint(pil_image)
             
-            image_info = {
-                'array': image_array,
-                'path': file_path,
-                'size': pil_image.size,
-                'mode': pil_image.mode,
-                'format': pil_image.format or os.path.splitext(file_path)[1][1:].upper(),
-                'filename': os.path.basename(file_path),
-                'fingerprint': fingerprint,
-                'load_time': datetime.now().isoformat(),
-                'file_size': os.path.getsize(file_path)
-            }
-            
-            # 生成图像哈希作为唯一标识
-            image_hash = self.generate_image_hash(image_array)
-            self.loaded_images[image_hash] = image_info
+            # 检查是否是已知图片: 快速指纹先粗筛, 有候选时再计算完整指纹确认
+            # (数据库只在锁内读写, 指纹计算在锁外进行, 以便多线程并行加载)
+            confirm = True
+            if fingerprint is not None and fingerprint[0] is None:
+                with self._lock:
+                    confirm = bool(self.find_similar_images(fingerprint, threshold=self.screen_threshold))
+                if reduced:
+                    # 缩小解码得到的dHash与全分辨率的可能有若干位不同, 只用于上面的粗筛;
+                    # 写入数据库的指纹按全分辨率重新读取计算, 与普通加载得到的指纹一致
+                    with Image.open(file_path) as full_image:
+                        if confirm:
+                            fingerprint = self.generate_perceptual_hash(full_image)
+                        else:
+                            fingerprint = self._fast_fingerprint(full_image)
+                elif confirm:
+                    fingerprint = self.generate_perceptual_hash(pil_image)
             
-            # 保存指纹到数据库
-            self.add_to_fingerprint_database(fingerprint, image_info)
+            if fingerprint is not None:
+                self._fp_cache[image_hash] = fingerprint
             
-            print(f"✓ 图像加载成功: {image_info['filename']}")
-            print(f"  尺寸: {image_info['size'][0]}x{image_info['size'][1]}")
-            print(f"  格式: {image_info['format']}")
-            print(f"  数字指纹: {fingerprint[:32]}...")
+            # 'array' 在首次访问时才生成
+            image_info = LoadedImage(
+                _pil_image=pil_image,
+                _reduced=reduced,
+                path=file_path,
+                size=size,
+                mode=mode,
+                format=pil_image.format or os.path.splitext(file_path)[1][1:].upper(),
+                filename=os.path.basename(file_path),
+                fingerprint=fingerprint,
+                load_time=datetime.now().isoformat(),
+                file_size=os.path.getsize(file_path)
+            )
             
-            # 显示相似图片信息
-            if similar_images:
-                print(f"\n🔍 发现相似图片:")
-                for idx, similar in enumerate(similar_images[:3], 1):
-                    print(f"  {idx}. 相似度: {similar['similarity']:.1f}%")
-                    print(f"     原始文件: {similar['data']['original_filename']}")
-                    print(f"     首次加载: {similar['data']['first_seen']}")
-                    if similar['similarity'] > 95:
-                        print(f"     ⚠️  这很可能是同一张图片!")
+            with self._lock:
+                similar_images = self.find_similar_images(fingerprint, threshold=90) if confirm else []
+                self._register_loaded_image(image_hash, image_info)
+                
+                # 保存指纹到数据库
+                self.add_to_fingerprint_database(fingerprint, image_info)
+                
+                print(f"✓ 图像加载成功: {image_info['filename']}")
+                print(f"  尺寸: {image_info['size'][0]}x{image_info['size'][1]}")
+                print(f"  格式: {image_info['format']}")
+                print(f"  数字指纹: {self.fingerprint_to_str(fingerprint)[:32]}...")
+                
+                # 显示相似图片信息
+                if similar_images:
+                    print(f"\n🔍 发现相似图片:")
+                    for idx, similar in enumerate(similar_images[:3], 1):
+                        print(f"  {idx}. 相似度: {similar['similarity']:.1f}%")
+                        print(f"     原始文件: {similar['data']['original_filename']}")
+                        print(f"     首次加载: {similar['data']['first_seen']}")
+                        if similar['similarity'] > 95:
+                            print(f"     ⚠️  这很可能是同一张图片!")
             
             return image_hash, image_info
             
         except Exception as e:
             raise Exception(f"图像加载失败: {str(e)}")
     
+    def load_images_from_paths(self, paths, fast_fingerprint=False, max_workers=None):
+        """批量导入图像 - 多线程并行解码和计算指纹
+        
+        fast_fingerprint 的含义与 load_image_from_path 相同
+        PIL解码时会释放GIL, 因此线程即可并行; 数据库的读写由锁串行化
+        返回 {文件路径: (图像哈希, 图像信息)}, 加载失败的文件会打印错误并跳过
+        """
+        def load(file_path):
+            try:
+                return self.load_image_from_path(file_path, fast_fingerprint=fast_fingerprint)
+            except Exception as e:
+                print(f"✗ 加载失败: {file_path} ({str(e)})")
+                return None
+        
+        paths = list(paths)  # 需要遍历两次, 生成器等一次性可迭代对象先转为列表
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            for file_path, result in zip(paths, executor.map(load, paths)):
+                if result is not None:
+                    results[file_path] = result
+        return results
+    
     def load_image_from_bytes(self, image_data, format_hint='JPEG'):
         """从字节数据导入图像"""
         try:
             # 将字节数据转换为PIL图像
             pil_image = Image.open(image_data)
-            image_array = np.array(pil_image)
             
-            image_info = {
-                'array': image_array,
-                'path': 'memory',
-                'size': pil_image.size,
-                'mode': pil_image.mode,
-                'format': format_hint
-            }
+            image_info = LoadedImage(
+                _pil_image=pil_image,
+                path='memory',
+                size=pil_image.size,
+                mode=pil_image.mode,
+                format=format_hint
+            )
             
-            image_hash = self.generate_image_hash(image_array)
-            self.loaded_images[image_hash] = image_info
+            image_hash = self.generate_image_hash(pil_image)
+            with self._lock:
+                self._register_loaded_image(image_hash, image_info)
             
             return image_hash, image_info
             
         except Exception as e:
             raise Exception(f"字节数据加载失败: {str(e)}")
     
-    def generate_image_hash(self, image_array):
-        """生成图像哈希值"""
-        # 将图像数据转换为字节
-        image_bytes = image_array.tobytes()
-        # 使用SHA256生成哈希
-        hash_object = hashlib.sha256(image_bytes)
-        return base64.b64encode(hash_object.digest()).decode('utf-8')[:32]
+    def _register_loaded_image(self, image_hash, image_info):
+        """记录已加载的图像并维护有序哈希索引"""
+        if image_hash not in self.loaded_images:
+            bisect.insort(self._sorted_hashes, image_hash)
+        self.loaded_images[image_hash] = image_info
+    
+    def find_images_by_prefix(self, prefix):
+        """按哈希前缀查找已加载的图像, 返回匹配的哈希列表"""
+        matched = []
+        idx = bisect.bisect_left(self._sorted_hashes, prefix)
+        while idx < len(self._sorted_hashes) and self._sorted_hashes[idx].startswith(prefix):
+            matched.append(self._sorted_hashes[idx])
+            idx += 1
+        return matched
+    
+    def generate_image_hash(self, pil_image):
+        """生成图像哈希值(仅用作会话内的图像标识, 不用于安全用途) - 接受PIL图像或numpy数组"""
+        pil_image = _to_pil_image(pil_image)
+        if self.exact_image_hash:
+            # 对完整的RGB像素数据做xxh3_128
+            if pil_image.mode != 'RGB':
+                pil_image = pil_image.convert('RGB')
+            digest = xxhash.xxh3_128(pil_image.tobytes()).digest()
+        else:
+            # 缩小到64x64后再哈希, 避免遍历整张大图
+            small = pil_image.resize((64, 64), Image.Resampling.BOX).convert('RGB')
+            digest = xxhash.xxh3_64(small.tobytes()).digest()
+        return base64.b64encode(digest).decode('utf-8')[:32]
     
-    def generate_perceptual_hash(self, image_array):
-        """生成感知哈希(数字指纹) - 图片内容相似则指纹相同"""
+    def generate_perceptual_hash(self, pil_image):
+        """生成感知哈希(数字指纹) - 图片内容相似则指纹相同
+        
+        接受PIL图像或numpy数组, 返回 (aHash, pHash, dHash) 三个64位整数组成的元组
+        """
         try:
-            # 转换为PIL图像
-            if image_array.dtype != np.uint8:
-                image_array = (image_array * 255).astype(np.uint8)
-            pil_image = Image.fromarray(image_array)
+            pil_image = _to_pil_image(pil_image)
             
-            # 使用多种哈希算法提高准确性
-            ahash = str(imagehash.average_hash(pil_image))
-            phash = str(imagehash.phash(pil_image))
-            dhash = str(imagehash.dhash(pil_image))
+            # 灰度转换只做一次, 三种哈希都从原尺寸灰度图缩放, 结果与imagehash逐位一致
+            gray = pil_image.convert('L')
+            
+            # 使用多种哈希算法提高准确性, 8x8哈希正好对应一个64位整数
+            pixels = np.asarray(gray.resize((8, 8), Image.Resampling.LANCZOS))
+            ahash = _bits_to_int(pixels > pixels.mean())
+            phash = int(str(imagehash.phash(gray)), 16)
+            dhash = self._dhash(gray)
             
             # 组合指纹
-            fingerprint = f"{ahash}_{phash}_{dhash}"
-            return fingerprint
+            return (ahash, phash, dhash)
+        except Exception as e:
+            print(f"生成指纹失败: {e}")
+            return None
+    
+    def _dhash(self, gray):
+        """由灰度图计算dHash(相邻像素的水平梯度)"""
+        pixels = np.asarray(gray.resize((9, 8), Image.Resampling.LANCZOS))
+        return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+    
+    def _fast_fingerprint(self, pil_image):
+        """生成快速指纹 - 只计算dHash, aHash/pHash 位置为None"""
+        try:
+            return (None, None, self._dhash(pil_image.convert('L')))
         except Exception as e:
             print(f"生成指纹失败: {e}")
             return None
     
+    def read_embedded_fingerprint(self, pil_image):
+        """读取图像元数据中嵌入的数字指纹(PNG文本块或JPEG EXIF), 不存在或格式不正确时返回None"""
+        value = pil_image.info.get('Fingerprint')
+        if value is None:
+            value = pil_image.getexif().get(0x9286)  # UserComment
+            if isinstance(value, bytes):
+                value = value.decode('utf-8', errors='ignore')
+            if not isinstance(value, str) or not value.startswith('Fingerprint:'):
+                return None
+            value = value[len('Fingerprint:'):]
+        
+        try:
+            fingerprint = self.fingerprint_from_str(value.strip('\x00 '))
+        except (AttributeError, ValueError):
+            return None
+        if len(fingerprint) != 3 or any(h is None or h >= 1 << 64 for h in fingerprint):
+            return None
+        return fingerprint
+    
+    def fingerprint_to_str(self, fingerprint):
+        """将指纹元组序列化为十六进制字符串 (aHash_pHash_dHash, 快速指纹中缺少的部分为空)"""
+        return '_'.join('' if h is None else f"{h:016x}" for h in fingerprint)
+    
+    def fingerprint_from_str(self, fingerprint_str):
+        """将十六进制字符串解析为指纹元组"""
+        return tuple(int(part, 16) if part else None for part in fingerprint_str.split('_'))
+    
     def calculate_fingerprint_similarity(self, fp1, fp2):
-        """计算两个指纹的相似度 (0-100)"""
+        """计算两个指纹的相似度 (0-100), 任一方为快速指纹时只比较dHash"""
         try:
-            parts1 = fp1.split('_')
-            parts2 = fp2.split('_')
-            
-            similarities = []
-            for p1, p2 in zip(parts1, parts2):
-                # 计算汉明距离
-                distance = sum(c1 != c2 for c1, c2 in zip(p1, p2))
-                max_len = max(len(p1), len(p2))
-                similarity = (1 - distance / max_len) * 100
-                similarities.append(similarity)
-            
-            return sum(similarities) / len(similarities)
+            a1, p1, d1 = fp1
+            a2, p2, d2 = fp2
+            # 异或后统计不同的位数即为汉明距离 (int.bit_count 对应硬件 POPCNT 指令)
+            if a1 is None or a2 is None:
+                return (1 - (d1 ^ d2).bit_count() / 64) * 100
+            distance = (a1 ^ a2).bit_count() + (p1 ^ p2).bit_count() + (d1 ^ d2).bit_count()
+            return (1 - distance / 192) * 100
         except:
             return 0
     
     def find_similar_images(self, fingerprint, threshold=90):
         """在数据库中查找相似图片"""
+        if fingerprint is None or not self._fp_ids:
+            return []
+        
+        query = np.array([0 if h is None else h for h in fingerprint], dtype=np.uint64)
+        # 双方都是完整指纹的行比较全部192位, 否则只比较dHash的64位
+        if fingerprint[0] is None:
+            full = np.zeros(len(self._fp_ids), dtype=bool)
+        else:
+            full = self._fp_full
+        # 达到阈值所允许的最大汉明距离
+        max_distance = math.floor((1 - threshold / 100) * 192 + 1e-9)
+        max_dhash_distance = math.floor((1 - threshold / 100) * 64 + 1e-9)
+        
+        scan = _get_numba_scanner() if len(self._fp_ids) >= _NUMBA_MIN_ROWS else None
+        if scan is not None:
+            # 大数据库: 用numba内核一次并行扫描完成异或、计数和阈值判断
+            distances, hits = scan(self._fp_matrix, full, query[0], query[1], query[2],
+                                                 max_distance, max_dhash_distance)
+            candidates = np.nonzero(hits)[0]
+            distances = distances[candidates]
+            full = full[candidates]
+        else:
+            dhash_distances = _popcount_rows(self._fp_matrix[:, 2] ^ query[2])
+            if full.any():
+                # 先比较aHash+dHash: 这两部分距离之和已超过上限的完整指纹不可能达到阈值, 直接跳过
+                partial_distances = dhash_distances + np.where(
+                    full, _popcount_rows(self._fp_matrix[:, 0] ^ query[0]), 0)
+                candidates = np.nonzero(partial_distances <= np.where(full, max_distance, max_dhash_distance))[0]
+                full = full[candidates]
+                
+                # 只对剩余条目计算pHash距离
+                distances = partial_distances[candidates] + np.where(
+                    full, _popcount_rows(self._fp_matrix[candidates, 1] ^ query[1]), 0)
+            else:
+                candidates = np.nonzero(dhash_distances <= max_dhash_distance)[0]
+                distances = dhash_distances[candidates]
+                full = full[candidates]
+        similarities = (1 - distances / np.where(full, 192.0, 64.0)) * 100
+        
         similar_images = []
-        for fp_id, fp_data in self.fingerprint_database.items():
-            similarity = self.calculate_fingerprint_similarity(
-                fingerprint, fp_data['fingerprint']
-            )
-            if similarity >= threshold:
-                similar_images.append({
-                    'id': fp_id,
-                    'similarity': similarity,
-                    'data': fp_data
-                })
+        for idx in np.nonzero(similarities >= threshold)[0]:
+            fp_id = self._fp_ids[candidates[idx]]
+            similar_images.append({
+                'id': fp_id,
+                'similarity': float(similarities[idx]),
+                'data': self.fingerprint_database[fp_id]
+            })
         
         # 按相似度排序
         similar_images.sort(key=lambda x: x['similarity'], reverse=True)
@@ -222,27 +535,27 @@ class ImageImportProcessor:
                 format = ext[1:].upper() if ext else 'JPEG'
             
             # 生成指纹
-            fingerprint = self.generate_perceptual_hash(image_array)
+            fingerprint = self.generate_perceptual_hash(pil_image)
+            fingerprint_str = self.fingerprint_to_str(fingerprint)
             
             # 保存图像(根据格式选择是否嵌入元数据)
             if format.upper() == 'PNG' and embed_fingerprint:
                 # PNG支持元数据
                 metadata = PngInfo()
-                metadata.add_text("Fingerprint", fingerprint)
+                metadata.add_text("Fingerprint", fingerprint_str)
                 metadata.add_text("SaveTime", datetime.now().isoformat())
                 metadata.add_text("ProcessedBy", "ImageImportProcessor")
                 pil_image.save(output_path, format='PNG', pnginfo=metadata)
             elif format.upper() in ['JPEG', 'JPG']:
                 # JPEG使用EXIF
                 exif = pil_image.getexif()
-                exif[0x9286] = f"Fingerprint:{fingerprint}"  # UserComment
+                exif[0x9286] = f"Fingerprint:{fingerprint_str}"  # UserComment
                 pil_image.save(output_path, format='JPEG', quality=quality, exif=exif)
             else:
                 pil_image.save(output_path, format=format, quality=quality)
             
             # 保存到指纹数据库
             save_info = {
-                'array': image_array,
                 'path': output_path,
                 'size': pil_image.size,
                 'mode': pil_image.mode,
@@ -251,10 +564,11 @@ class ImageImportProcessor:
                 'fingerprint': fingerprint,
                 'file_size': os.path.getsize(output_path)
             }
-            self.add_to_fingerprint_database(fingerprint, save_info)
+            with self._lock:
+                self.add_to_fingerprint_database(fingerprint, save_info)
             
             print(f"✓ 图像已保存: {output_path}")
-            print(f"  数字指纹: {fingerprint[:32]}...")
+            print(f"  数字指纹: {fingerprint_str[:32]}...")
             print(f"  文件大小: {os.path.getsize(output_path)} 字节")
             
             return True
@@ -265,18 +579,27 @@ class ImageImportProcessor:
     
     def add_to_fingerprint_database(self, fingerprint, image_info):
         """添加指纹到数据库"""
-        fp_id = hashlib.md5(fingerprint.encode()).hexdigest()[:16]
+        fp_id = self._fingerprint_id(self.fingerprint_to_str(fingerprint))
+        is_full = fingerprint[0] is not None
+        
+        # 同一图片此前只记录了快速指纹时, 将该记录升级为完整指纹
+        if is_full:
+            partial_id = self._fingerprint_id(self.fingerprint_to_str((None, None, fingerprint[2])))
+            if partial_id in self.fingerprint_database:
+                self._upgrade_fingerprint_record(partial_id, fp_id, fingerprint)
         
         if fp_id not in self.fingerprint_database:
             self.fingerprint_database[fp_id] = {
-                'fingerprint': fingerprint,
                 'original_filename': image_info['filename'],
                 'first_seen': datetime.now().isoformat(),
                 'locations': [],
                 'count': 0
             }
+        if fp_id not in self._fp_rows:
+            # 新记录, 或指纹文件丢失后保留下来的记录: 补上指纹行
+            self._append_fingerprint_row(fp_id, fingerprint)
         
-        # 添加位置记录
+        # 添加位置记录 (只保存这几个小字段, 不能引用图像数组等大对象)
         self.fingerprint_database[fp_id]['locations'].append({
             'path': image_info['path'],
             'filename': image_info['filename'],
@@ -285,46 +608,211 @@ class ImageImportProcessor:
         })
         self.fingerprint_database[fp_id]['count'] += 1
         
-        # 自动保存
-        self.save_fingerprint_database()
+        # 标记为待保存, 达到写入间隔时自动保存
+        self._mark_dirty()
+        self._writes_since_flush += 1
+        if self._writes_since_flush >= self.write_interval:
+            self.save_fingerprint_database()
+    
+    def _fingerprint_id(self, fingerprint_str):
+        """由指纹字符串生成数据库记录ID"""
+        return xxhash.xxh3_64_hexdigest(fingerprint_str.encode())
+    
+    def _upgrade_fingerprint_record(self, old_id, new_id, fingerprint):
+        """将快速指纹记录升级为完整指纹记录"""
+        record = self.fingerprint_database.pop(old_id)
+        
+        if new_id in self.fingerprint_database:
+            # 完整指纹记录已存在: 合并位置记录并删除旧行
+            existing = self.fingerprint_database[new_id]
+            existing['locations'].extend(record['locations'])
+            existing['count'] += record['count']
+            if old_id in self._fp_rows:
+                self._remove_fingerprint_row(old_id)
+        else:
+            self.fingerprint_database[new_id] = record
+            if old_id not in self._fp_rows:
+                return  # 旧记录没有指纹行, 由调用方追加
+            row = self._fp_rows.pop(old_id)
+            self._fp_ids[row] = new_id
+            self._fp_rows[new_id] = row
+            self._fp_buffer[row] = fingerprint
+            self._fp_full_buffer[row] = True
+        self._mark_dirty()
+    
+    @property
+    def _fp_matrix(self):
+        """有效的指纹矩阵 (预分配缓冲区的前 len(self._fp_ids) 行)"""
+        return self._fp_buffer[:len(self._fp_ids)]
+    
+    @property
+    def _fp_full(self):
+        """每行是否为完整指纹(否则只有dHash)"""
+        return self._fp_full_buffer[:len(self._fp_ids)]
+    
+    def _set_fingerprint_index(self, ids, matrix, full):
+        """用给定的记录ID和指纹矩阵替换当前指纹索引"""
+        self._fp_ids = list(ids)
+        self._fp_rows = {fp_id: row for row, fp_id in enumerate(self._fp_ids)}  # 记录ID -> 行号
+        self._fp_buffer = np.array(matrix, dtype=np.uint64).reshape(-1, 3)
+        self._fp_full_buffer = np.array(full, dtype=bool)
+    
+    def _append_fingerprint_row(self, fp_id, fingerprint):
+        """追加一行指纹, 容量不足时按倍数扩容 (均摊O(1), 避免每次插入都复制整个矩阵)"""
+        count = len(self._fp_ids)
+        if count == len(self._fp_buffer):
+            capacity = max(16, 2 * count)
+            buffer = np.zeros((capacity, 3), dtype=np.uint64)
+            buffer[:count] = self._fp_buffer[:count]
+            full = np.zeros(capacity, dtype=bool)
+            full[:count] = self._fp_full_buffer[:count]
+            self._fp_buffer, self._fp_full_buffer = buffer, full
+        
+        self._fp_buffer[count] = [0 if h is None else h for h in fingerprint]
+        self._fp_full_buffer[count] = fingerprint[0] is not None
+        self._fp_rows[fp_id] = count
+        self._fp_ids.append(fp_id)
+    
+    def _remove_fingerprint_row(self, fp_id):
+        """删除一行指纹, 用最后一行填补空位, 避免移动整个矩阵"""
+        row = self._fp_rows.pop(fp_id)
+        last = len(self._fp_ids) - 1
+        last_id = self._fp_ids.pop()
+        if row != last:
+            self._fp_buffer[row] = self._fp_buffer[last]
+            self._fp_full_buffer[row] = self._fp_full_buffer[last]
+            self._fp_ids[row] = last_id
+            self._fp_rows[last_id] = row
     
     def save_fingerprint_database(self):
         """保存指纹数据库到文件"""
-        try:
-            # 确保目录存在
-            os.makedirs(os.path.dirname(self.storage_file), exist_ok=True)
-            
-            with open(self.storage_file, 'w', encoding='utf-8') as f:
-                json.dump(self.fingerprint_database, f, indent=2, ensure_ascii=False)
-            print(f"💾 数据库已保存到: {self.storage_file}")
+        with self._lock:
+            try:
+                # 确保目录存在
+                os.makedirs(os.path.dirname(self.storage_file), exist_ok=True)
+                
+                # 先写入临时文件再替换, 保存中途出错时不会留下损坏或互不匹配的数据库文件
+                matrix_tmp = self.matrix_file + '.tmp'
+                storage_tmp = self.storage_file + '.tmp'
+                
+                # 指纹矩阵 (传入文件对象, 避免numpy自动追加.npz后缀)
+                with open(matrix_tmp, 'wb') as f:
+                    np.savez_compressed(f, matrix=self._fp_matrix, full=self._fp_full,
+                                        ids=np.array(self._fp_ids, dtype=str))
+                
+                # 元数据
+                option = orjson.OPT_INDENT_2 if self.pretty_json else 0
+                with open(storage_tmp, 'wb') as f:
+                    f.write(orjson.dumps(self.fingerprint_database, option=option))
+                
+                os.replace(matrix_tmp, self.matrix_file)
+                os.replace(storage_tmp, self.storage_file)
+                self._dirty = False
+                self._writes_since_flush = 0
+                _dirty_processors.discard(self)
+                print(f"💾 数据库已保存到: {self.storage_file}")
+                return True
+            except Exception as e:
+                print(f"✗ 保存数据库失败: {e}")
+                return False
+    
+    def _mark_dirty(self):
+        """标记有未保存的修改, 并登记到退出时需要写入的处理器中"""
+        self._dirty = True
+        _dirty_processors.add(self)
+    
+    def flush_fingerprint_database(self):
+        """保存尚未写入文件的修改"""
+        with self._lock:
+            if self._dirty:
+                return self.save_fingerprint_database()
             return True
-        except Exception as e:
-            print(f"✗ 保存数据库失败: {e}")
-            return False
+    
+    def clear_fingerprint_database(self):
+        """清空指纹数据库并保存"""
+        with self._lock:
+            self.fingerprint_database = {}
+            self._rebuild_fingerprint_index()
+            return self.save_fingerprint_database()
+    
+    def _rebuild_fingerprint_index(self):
+        """根据记录中的指纹字符串(旧版JSON格式)重建指纹矩阵"""
+        # 旧版记录ID由MD5生成, 按当前方式重新生成以便与新加载的图片对应
+        records = {}
+        fp_ids = []
+        fingerprints = []
+        for old_id, fp_data in self.fingerprint_database.items():
+            fingerprint_str = fp_data.pop('fingerprint', None)
+            if fingerprint_str is None:
+                # 没有指纹字符串的记录(新版格式)保留元数据, 但无法参与比较
+                records.setdefault(old_id, fp_data)
+                continue
+            fp_id = self._fingerprint_id(fingerprint_str)
+            if fp_id not in records:
+                records[fp_id] = fp_data
+                fp_ids.append(fp_id)
+                fingerprints.append(self.fingerprint_from_str(fingerprint_str))
+        self.fingerprint_database = records
+        rows = [[0 if h is None else h for h in fp] for fp in fingerprints]
+        self._set_fingerprint_index(fp_ids, rows,
+                                    [fp[0] is not None for fp in fingerprints])
+    
+    def _load_fingerprint_matrix(self):
+        """从二进制文件加载指纹矩阵"""
+        with np.load(self.matrix_file) as data:
+            ids = data['ids'].tolist()
+            matrix = data['matrix']
+            full = data['full']
+        
+        # 只保留元数据中存在的记录的指纹行
+        keep = np.array([fp_id in self.fingerprint_database for fp_id in ids], dtype=bool)
+        self._set_fingerprint_index([fp_id for fp_id, kept in zip(ids, keep) if kept],
+                                    matrix[keep], full[keep])
+        
+        # 没有指纹行的记录(例如两个文件未能同时写入)保留元数据, 与指纹文件丢失时的处理相同
+        missing = len(self.fingerprint_database) - len(self._fp_ids)
+        if missing:
+            print(f"⚠️  {missing} 条记录在指纹文件中没有对应的指纹, 暂时无法参与相似度比较")
     
     def load_fingerprint_database(self):
         """从文件加载指纹数据库"""
         if os.path.exists(self.storage_file):
             try:
-                with open(self.storage_file, 'r', encoding='utf-8') as f:
-                    self.fingerprint_database = json.load(f)
+                with open(self.storage_file, 'rb') as f:
+                    self.fingerprint_database = orjson.loads(f.read())
+                if os.path.exists(self.matrix_file):
+                    self._load_fingerprint_matrix()
+                elif any('fingerprint' in fp_data for fp_data in self.fingerprint_database.values()):
+                    # 旧版数据库: 指纹以字符串保存在JSON中, 下次保存时迁移为二进制格式
+                    self._rebuild_fingerprint_index()
+                    self._mark_dirty()
+                    print(f"ℹ️  检测到旧版数据库格式, 将迁移到: {self.matrix_file}")
+                else:
+                    # 新版数据库但指纹文件丢失: 保留元数据, 这些记录在重新加载对应图片前不参与比较
+                    self._rebuild_fingerprint_index()
+                    if self.fingerprint_database:
+                        print(f"⚠️  未找到指纹文件: {self.matrix_file}")
+                        print(f"  {len(self.fingerprint_database)} 条记录暂时无法参与相似度比较")
                 print(f"✓ 已加载指纹数据库: {len(self.fingerprint_database)} 条记录")
                 print(f"  文件: {self.storage_file}")
                 print(f"  大小: {os.path.getsize(self.storage_file)} 字节")
             except Exception as e:
                 print(f"✗ 加载数据库失败: {e}")
                 print(f"  尝试备份损坏的文件...")
-                try:
-                    backup_file = self.storage_file + '.backup'
-                    os.rename(self.storage_file, backup_file)
-                    print(f"  已备份到: {backup_file}")
-                except:
-                    pass
+                for damaged_file in (self.storage_file, self.matrix_file):
+                    try:
+                        backup_file = damaged_file + '.backup'
+                        os.rename(damaged_file, backup_file)
+                        print(f"  已备份到: {backup_file}")
+                    except:
+                        pass
                 self.fingerprint_database = {}
+                self._rebuild_fingerprint_index()
         else:
             print(f"ℹ️  未找到历史数据库,将创建新数据库")
             print(f"  位置: {self.storage_file}")
             self.fingerprint_database = {}
+            self._rebuild_fingerprint_index()
     
     def display_fingerprint_database(self):
         """显示指纹数据库内容"""
@@ -441,7 +929,8 @@ class ImageImportProcessor:
         print("\n当前会话已加载的图像:")
         print("-" * 80)
         for idx, (hash_key, info) in enumerate(self.loaded_images.items(), 1):
-            fp_short = info.get('fingerprint', 'N/A')[:16]
+            fingerprint = info.get('fingerprint')
+            fp_short = self.fingerprint_to_str(fingerprint)[:16] if fingerprint else 'N/A'
             print(f"{idx}. [{hash_key[:16]}...] {info['filename']}")
             print(f"    尺寸: {info['size'][0]}x{info['size'][1]} | 指纹: {fp_short}...")
     
@@ -514,6 +1003,7 @@ def usage_example():
         choice = input("\n请输入选项: ").strip().lower()
         
         if choice == 'q':
+            processor.flush_fingerprint_database()
             print("\n✓ 数据已自动保存")
             print("感谢使用,再见!")
             break
@@ -541,7 +1031,7 @@ def usage_example():
             processor.list_loaded_images()
             if processor.loaded_images:
                 hash_input = input("\n请输入图像哈希的前几位: ").strip()
-                matched = [h for h in processor.loaded_images.keys() if h.startswith(hash_input)]
+                matched = processor.find_images_by_prefix(hash_input)
                 if matched:
                     processor.display_image_info(matched[0])
                 else:
@@ -551,7 +1041,7 @@ def usage_example():
             processor.list_loaded_images()
             if processor.loaded_images:
                 hash_input = input("\n请输入要保存的图像哈希的前几位: ").strip()
-                matched = [h for h in processor.loaded_images.keys() if h.startswith(hash_input)]
+                matched = processor.find_images_by_prefix(hash_input)
                 
                 if matched:
                     output_path = input("请输入保存路径 (如: output.png): ").strip()
@@ -595,8 +1085,7 @@ processor.display_fingerprint_database()
         elif choice == '8':
             confirm = input("\n⚠️  确认清空指纹数据库? (yes/no): ").strip().lower()
             if confirm == 'yes':
-                processor.fingerprint_database = {}
-                processor.save_fingerprint_database()
+                processor.clear_fingerprint_database()
                 print("✓ 数据库已清空")
             else:
                 print("✗ 操作已取消")
@@ -609,6 +1098,9 @@ processor.display_fingerprint_database()
                 print(f"  大小: {os.path.getsize(processor.storage_file)} 字节")
                 print(f"  记录数: {len(processor.fingerprint_database)}")
                 print(f"  最后修改: {datetime.fromtimestamp(os.path.getmtime(processor.storage_file))}")
+                print(f"  指纹文件: {processor.matrix_file}")
+                if os.path.exists(processor.matrix_file):
+                    print(f"  指纹文件大小: {os.path.getsize(processor.matrix_file)} 字节")
             else:
                 print(f"  状态: ✗ 文件不存在 (将在保存时自动创建)")
         